@@ -1,23 +1,32 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import os, re, time, json, logging, sys, threading, random
+import os, re, time, json, logging, sys, threading, random, math
+PROCESS_T0 = time.perf_counter()
 from dataclasses import dataclass, asdict, field
 from typing import List, Dict, Optional, Tuple
 from urllib.parse import urljoin, urlparse, urlunparse
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 from pathlib import Path
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-
-# Selenium
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.options import Options as FFOptions
-from selenium.webdriver.firefox.service import Service as FFService
-from selenium.webdriver.support.ui import WebDriverWait, Select
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, JavascriptException
-from webdriver_manager.firefox import GeckoDriverManager
+
+# Selenium / webdriver-manager / BeautifulSoup são importados sob demanda
+# (ver _load_selenium e parse_title_desc_imgs) para o start não pagar o custo à toa.
+webdriver = By = FFOptions = FFService = WebDriverWait = Select = EC = None
+TimeoutException = JavascriptException = None
+
+def _load_selenium() -> None:
+    global webdriver, By, FFOptions, FFService, WebDriverWait, Select, EC, TimeoutException, JavascriptException
+    if webdriver is not None: return
+    from selenium import webdriver as _wd
+    from selenium.webdriver.common.by import By as _By
+    from selenium.webdriver.firefox.options import Options as _FFOptions
+    from selenium.webdriver.firefox.service import Service as _FFService
+    from selenium.webdriver.support.ui import WebDriverWait as _WDW, Select as _Select
+    from selenium.webdriver.support import expected_conditions as _EC
+    from selenium.common.exceptions import TimeoutException as _TE, JavascriptException as _JE
+    By, FFOptions, FFService, WebDriverWait, Select, EC = _By, _FFOptions, _FFService, _WDW, _Select, _EC
+    TimeoutException, JavascriptException = _TE, _JE
+    webdriver = _wd
 
 # ============================== Config & Logging ==============================
 env_path = Path(__file__).with_name("logininfo.env")
@@ -26,13 +35,15 @@ if env_path.exists():
 else:
     load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout), logging.FileHandler("scraper.log", mode="a", encoding="utf-8")],
-)
 log = logging.getLogger("zarpellon")
 
+def setup_logging() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout), logging.FileHandler("scraper.log", mode="a", encoding="utf-8")],
+    )
+
 # ------------------------------ Ajustes gerais ------------------------------- 
 BASE       = "https://zarpellonjoias.com.br"                                    # URL raiz do site alvo.
 LOGIN_PATH = "/login"                                                           # Caminho relativo da página de login.
@@ -42,6 +53,7 @@ PWD    = os.getenv("ZARPELLON_PASS")                                           #
 
 # Concurrency e tempos (scraping)
 N_WORKERS               = 4                                                     # Número de workers (threads) para raspar páginas/produtos em paralelo.
+TABS_PER_WORKER         = 1                                                     # Abas por Firefox (worker); >1 carrega várias páginas em paralelo no mesmo processo.
 PAGELOAD_TIMEOUT_S      = 15                                                    # Tempo máximo (segundos) para esperar o carregamento de uma página.
 AFTER_NAV_DELAY_S       = 0.25                                                  # Pausa curta após cada navegação (reduz race conditions).
 PRODUCT_READY_TIMEOUT_S = 1.5                                                   # Janela (segundos) para aguardar elementos essenciais do produto aparecerem.
@@ -59,6 +71,49 @@ QUIET_AFTER_403_S   = 5.0
 MAX_PAGES_PER_CAT   = 2000                                                      # Teto de páginas por categoria (anti-loop/anti-paginação infinita).
 ENABLE_SLOW_RETRY   = True                                                      # Ativa rota de retry mais “lenta” (interv. maiores) se falhas persistirem.
 
+# Descoberta de produtos
+DISCOVERY_MODE      = "browser"                                                 # "browser" (paginação no Firefox) ou "sitemap" (sitemap/feed + navegador só p/ lacunas).
+PRODUCT_FEED_URL    = os.getenv("ZARPELLON_FEED_URL")                           # Feed de produtos (RSS/Atom estilo Google Merchant), opcional; dá a categoria de cada produto.
+SITEMAP_MAX_DOCS    = 50                                                        # Teto de documentos de sitemap lidos (índices + sub-sitemaps).
+SITEMAP_MAX_GAP_RATIO = 0.5                                                     # Acima dessa fração de produtos sem categoria conhecida, pagina as categorias no navegador.
+HTTP_TIMEOUT_S      = 15                                                        # Timeout das requisições HTTP leves (robots/sitemap/feed).
+
+# Cache HTTP condicional (ETag/Last-Modified + hash do corpo)
+HTTP_CACHE_ENABLED  = False                                                     # Se True, revalida cada página via HTTP antes de abrir no navegador.
+HTTP_CACHE_DIR      = "http_cache"                                              # Diretório do cache em disco (índice + payloads).
+HTTP_CACHE_MAX_MB   = 200                                                       # Tamanho máximo do cache; acima disso remove os menos usados (LRU).
+HTTP_CACHE_TRUST_HTML = False                                                   # Se True, revalida também páginas de produto e reaproveita o item inalterado (só se o estoque vier no HTML).
+
+# Índice local (SQLite) sobre o resultado
+INDEX_ENABLED       = True                                                      # Gera <saida>.sqlite ao fim de cada ciclo (consultas por SKU/produto/categoria/material).
+
+# Pipeline (filas limitadas entre estágios)
+PIPE_JOB_QUEUE      = 256                                                       # Jobs descobertos aguardando um navegador (descoberta bloqueia se encher).
+PIPE_PARSE_QUEUE    = 32                                                        # Páginas (HTML) aguardando parse; limita a memória com HTML em trânsito.
+PIPE_RESULT_QUEUE   = 256                                                       # Itens prontos aguardando consolidação.
+PIPE_PARSE_THREADS  = 2                                                         # Threads do estágio de parse (BeautifulSoup).
+PIPE_STATS_EVERY_S  = 30                                                        # Intervalo (s) do log de profundidade das filas.
+
+# Governador de recursos do navegador (por worker)
+GOV_CHECK_EVERY_S    = 5                                                        # Intervalo (s) entre medições de memória/progresso dos workers.
+GOV_STALL_S          = 180                                                      # Sem progresso por esse tempo (s) com job em andamento → mata e reinicia o navegador.
+GOV_MAX_RSS_MB       = 2048                                                     # RSS máx. (MB) do Firefox de um worker (soma dos processos); 0 = sem limite.
+GOV_MAX_TOTAL_RSS_MB = 0                                                        # Teto (MB) somando todos os navegadores; 0 = sem teto. Reinicia o maior.
+GOV_REQUEUE_MAX      = 1                                                        # Vezes que um job interrompido por travamento volta à fila antes do retry lento.
+
+# Profiling (opt-in via --profile)
+PROFILE_ENABLED     = False                                                     # Se True, amostra as pilhas de todas as threads durante o ciclo.
+PROFILE_PREFIX      = "profile"                                                 # Prefixo dos arquivos gerados (<prefixo>-<data>.folded / _top.txt).
+PROFILE_SAMPLE_MS   = 10                                                        # Intervalo de amostragem (ms); maior = menos overhead.
+PROFILE_TOP_N       = 25                                                        # Quantidade de hotspots listados no relatório.
+
+# Agendamento de revisitas por volatilidade (modo --loop)
+REVISIT_BUDGET_PER_H = 0                                                        # Páginas de produto por hora; 0 = sem agendamento (revisita tudo em todo ciclo).
+REVISIT_STATE_FILE   = "revisit_state.json"                                     # Histórico de mudanças (estoque/preço) por produto entre ciclos.
+REVISIT_EWMA_ALPHA   = 0.3                                                      # Peso do ciclo mais recente na taxa de mudança (média móvel exponencial).
+REVISIT_MIN_RATE     = 0.02                                                     # Taxa mínima: produtos estáticos ainda "envelhecem" e voltam à fila.
+REVISIT_MAX_AGE_H    = 24.0                                                     # Acima dessa idade (horas) o produto passa à frente dos demais.
+
 # Categorias (raiz do site)
 CATEGORIES = {
     "Anéis":      f"{BASE}/categorias-aneis",                                   # URL da lista de produtos da categoria Anéis.
@@ -70,6 +125,11 @@ CATEGORIES = {
     "Pulseiras":  f"{BASE}/categorias-pulseiras",                               # URL da lista de produtos da categoria Pulseiras.
 }
 
+# geckodriver (cache local do caminho resolvido pelo webdriver-manager)
+GECKO_PATH_ENV      = os.getenv("GECKODRIVER_PATH")                             # Caminho explícito do geckodriver (pula qualquer resolução).
+GECKO_CACHE_FILE    = Path(__file__).with_name(".geckodriver.json")             # Cache do caminho resolvido (permite rodar offline).
+GECKO_CACHE_TTL_H   = 24 * 7                                                    # Após esse prazo (horas) tenta revalidar a versão online; se falhar, usa o cache.
+
 # UA/idioma
 UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:141.0) Gecko/20100101 Firefox/141.0"  # User-Agent “desktop Firefox” a ser enviado.
 ACCEPT_LANG = "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7"                                      # Preferência de idioma nas requisições HTTP.
@@ -94,6 +154,40 @@ def product_base_id(url: str) -> Optional[str]:
     return m.group(1) if m else None
 
 # ============================== Firefox setup ==============================
+_GECKO_PATH: Optional[str] = None
+
+def _read_gecko_cache() -> Tuple[Optional[str], float]:
+    try:
+        data = json.loads(GECKO_CACHE_FILE.read_text(encoding="utf-8"))
+        path = data.get("path")
+        if path and Path(path).is_file():
+            return path, float(data.get("resolved_at") or 0.0)
+    except Exception: pass
+    return None, 0.0
+
+def resolve_geckodriver(force_refresh: bool = False) -> str:
+    """Resolve o geckodriver uma vez por processo, com cache em disco.
+
+    Ordem: GECKODRIVER_PATH → memória → cache em disco (dentro do TTL) → webdriver-manager (rede).
+    Se a rede falhar e houver cache (mesmo vencido), usa o cache."""
+    global _GECKO_PATH
+    if GECKO_PATH_ENV: return GECKO_PATH_ENV
+    if _GECKO_PATH and not force_refresh: return _GECKO_PATH
+    cached, resolved_at = _read_gecko_cache()
+    if cached and not force_refresh and (time.time() - resolved_at) < GECKO_CACHE_TTL_H * 3600:
+        _GECKO_PATH = cached; return cached
+    try:
+        from webdriver_manager.firefox import GeckoDriverManager
+        path = GeckoDriverManager().install()
+    except Exception as e:
+        if not cached: raise
+        log.warning("Falha ao revalidar geckodriver (%s); usando cache %s", e, cached)
+        _GECKO_PATH = cached; return cached
+    try: GECKO_CACHE_FILE.write_text(json.dumps({"path": path, "resolved_at": time.time()}), encoding="utf-8")
+    except Exception: pass
+    _GECKO_PATH = path
+    return path
+
 def build_firefox_options(headless=True) -> FFOptions:
     opts = FFOptions()
     if headless:
@@ -117,6 +211,7 @@ def _post_warmup_stealth(driver):
     except Exception: pass
 
 def new_driver(gecko_path: str, headless=True):
+    _load_selenium()
     drv = webdriver.Firefox(service=FFService(gecko_path), options=build_firefox_options(headless=headless))
     drv.set_page_load_timeout(PAGELOAD_TIMEOUT_S)
     _post_warmup_stealth(drv)
@@ -126,6 +221,20 @@ def new_driver(gecko_path: str, headless=True):
     except Exception: pass
     return drv
 
+# Navegação não bloqueante (modo multi-aba): marca a janela e troca de URL via JS;
+# a marca some quando o novo documento é criado, sinalizando que a navegação efetivou.
+JS_TAB_NAV = "window.__zarpNav = 1; window.location.href = arguments[0];"
+JS_TAB_READY = "return (window.__zarpNav === undefined) && document.readyState !== 'loading';"
+
+def tab_start_nav(driver, url: str) -> None:
+    note_product_load()
+    try: driver.execute_script(JS_TAB_NAV, url)
+    except Exception: pass
+
+def tab_is_ready(driver) -> bool:
+    try: return bool(driver.execute_script(JS_TAB_READY))
+    except Exception: return False
+
 # ============================== Login no site (para scraping) ==============================
 def looks_logged_html(html: str) -> bool:
     t=(html or "").lower()
@@ -148,14 +257,17 @@ def accept_cookies(wait: WebDriverWait):
             wait.until(EC.element_to_be_clickable((by, sel))).click(); break
         except Exception: pass
 
-def login_and_collect_auth(gecko_path: str, headless=True) -> Tuple[webdriver.Firefox, List[dict], Dict[str,str]]:
+def login_and_collect_auth(gecko_path: str, headless=True, t_cycle: Optional[float] = None) -> Tuple[webdriver.Firefox, List[dict], Dict[str,str]]:
     if not EMAIL or not PWD:
         raise RuntimeError("Credenciais ausentes. Defina ZARPELLON_USER e ZARPELLON_PASS no .env")
 
     driver = new_driver(gecko_path, headless=headless)
+    now = time.perf_counter()
+    log.info("Tempo até a 1ª requisição: %.2fs (ciclo) / %.2fs (processo)",
+             now - (t_cycle if t_cycle is not None else PROCESS_T0), now - PROCESS_T0)
     wait = WebDriverWait(driver, 25)
     log.info("Abrindo %s", urljoin(BASE, LOGIN_PATH))
-    driver.get(urljoin(BASE, LOGIN_PATH))
+    driver.get(urljoin(BASE, LOGIN_PATH)); note_discovery_load(2)   # página de login + envio
     accept_cookies(wait)
 
     email_el = wait.until(EC.presence_of_element_located((By.NAME, "email")))
@@ -181,7 +293,7 @@ def login_and_collect_auth(gecko_path: str, headless=True) -> Tuple[webdriver.Fi
     return driver, cookies, localstorage
 
 def prime_auth_on_driver(driver, cookies: List[dict], localstorage: Dict[str,str]):
-    driver.get(BASE + "/")
+    driver.get(BASE + "/"); note_product_load()
     for c in cookies:
         try:
             c2 = {k: c[k] for k in ("name","value","path","domain","expiry","httpOnly","secure") if k in c}
@@ -350,10 +462,22 @@ def _click_load_more(driver, timeout: int = 6) -> bool:
         except Exception: pass
     return False
 
+# Páginas carregadas no ciclo (navegador + HTTP), cobradas do budget de requisições do --loop.
+PAGE_LOADS = {"discovery": 0, "product": 0}
+_PAGE_LOADS_LOCK = threading.Lock()
+
+def note_discovery_load(n: int = 1) -> None:
+    with _PAGE_LOADS_LOCK: PAGE_LOADS["discovery"] += n
+
+def note_product_load(n: int = 1) -> None:
+    """Cargas fora da descoberta: produto, retentativas, referer hop, revalidação HTTP, abertura de navegador."""
+    with _PAGE_LOADS_LOCK: PAGE_LOADS["product"] += n
+
 def collect_all_links_with_pagination(driver, cat_url: str) -> list[str]:
     try: driver.get(BASE + "/"); time.sleep(0.12)
     except Exception: pass
 
+    note_discovery_load(2)
     driver.get(cat_url)
     try: wait_grid_ready(driver, timeout=10)
     except Exception: time.sleep(0.25)
@@ -369,6 +493,7 @@ def collect_all_links_with_pagination(driver, cat_url: str) -> list[str]:
             if not _click_page_number_fast(driver, page, timeout=6):
                 if not _click_next(driver, timeout=6):
                     break
+            note_discovery_load()
             try: wait_grid_ready(driver, timeout=4)
             except Exception: pass
             time.sleep(0.10)
@@ -380,6 +505,7 @@ def collect_all_links_with_pagination(driver, cat_url: str) -> list[str]:
         steps += 1
         prev = len(all_links)
         if not _click_next(driver, timeout=6): break
+        note_discovery_load()
         try: wait_grid_ready(driver, timeout=4)
         except Exception: pass
         time.sleep(0.10)
@@ -394,6 +520,8 @@ def collect_all_links_with_pagination(driver, cat_url: str) -> list[str]:
             try: driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
             except Exception: pass
             time.sleep(0.20)
+        else:
+            note_discovery_load()
         try: wait_grid_ready(driver, timeout=4)
         except Exception: pass
         time.sleep(0.10)
@@ -435,6 +563,7 @@ def collect_links_category_and_subs(driver, cat_url: str) -> list[str]:
     links_cat = collect_all_links_with_pagination(driver, cat_url)
     all_links.update(links_cat)
     if len(links_cat) < 80:
+        note_discovery_load()
         try: driver.get(cat_url); time.sleep(0.25)
         except Exception: pass
         all_links.update(js_collect_links_from_scripts(driver))
@@ -445,11 +574,245 @@ def collect_links_category_and_subs(driver, cat_url: str) -> list[str]:
         links_sub = collect_all_links_with_pagination(driver, sub)
         all_links.update(links_sub)
         if len(links_sub) < 60:
+            note_discovery_load()
             try: driver.get(sub); time.sleep(0.2)
             except Exception: pass
             all_links.update(js_collect_links_from_scripts(driver))
 
     return sorted(all_links)
+
+# ============================== Cache HTTP condicional ==============================
+class HttpCache:
+    """Cache em disco por URL normalizada, com validadores HTTP e LRU por tamanho.
+
+    Para cada URL guarda ETag/Last-Modified, o hash do corpo e um payload (o corpo
+    bruto, p/ sitemaps, ou o ProductItem já processado, p/ produtos). Os validadores
+    só são gravados junto com o payload, para nunca marcar como "atual" algo que
+    não chegou a ser processado."""
+    def __init__(self, root: str = HTTP_CACHE_DIR, max_mb: float = HTTP_CACHE_MAX_MB):
+        self.root = Path(root); self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.reset_stats()
+        try: self.index: Dict[str, Dict] = json.loads((self.root / "index.json").read_text(encoding="utf-8"))
+        except Exception: self.index = {}
+
+    def reset_stats(self) -> None:
+        """Zera os contadores (o cache é global ao processo; o resumo é por ciclo)."""
+        self.stats = {k: {"not_modified": 0, "same_hash": 0, "miss": 0, "error": 0} for k in ("produto", "sitemap")}
+        self.evicted = 0
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return normalize_url(url)
+
+    def _file(self, key: str) -> Path:
+        import hashlib
+        return self.root / (hashlib.sha1(key.encode("utf-8")).hexdigest() + ".bin")
+
+    def headers_for(self, url: str) -> Dict[str, str]:
+        with self.lock: ent = self.index.get(self._key(url))
+        h: Dict[str, str] = {}
+        if ent and ent.get("etag"): h["If-None-Match"] = ent["etag"]
+        if ent and ent.get("last_modified"): h["If-Modified-Since"] = ent["last_modified"]
+        return h
+
+    def check(self, url: str, resp, kind: str = "produto") -> Tuple[bool, Dict]:
+        """(inalterado?, validadores novos) a partir da resposta HTTP; `kind` separa as estatísticas."""
+        import hashlib
+        st = self.stats[kind]
+        if resp is None or resp.status_code not in (200, 304):
+            with self.lock: st["error"] += 1
+            return False, {}
+        with self.lock: ent = dict(self.index.get(self._key(url)) or {})
+        if resp.status_code == 304 and ent:
+            with self.lock: st["not_modified"] += 1
+            return True, ent
+        val = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified"),
+               "body_hash": hashlib.sha1(resp.content or b"").hexdigest()}
+        same = bool(ent) and ent.get("body_hash") == val["body_hash"]
+        with self.lock: st["same_hash" if same else "miss"] += 1
+        return same, val
+
+    def get(self, url: str) -> Optional[bytes]:
+        key = self._key(url)
+        with self.lock:
+            ent = self.index.get(key)
+            if not ent: return None
+            ent["atime"] = time.time()
+        try: return self._file(key).read_bytes()
+        except Exception: return None
+
+    def put(self, url: str, payload: bytes, validators: Dict) -> None:
+        key = self._key(url); f = self._file(key)
+        try: f.write_bytes(payload)
+        except Exception: return
+        with self.lock:
+            self.index[key] = {"etag": validators.get("etag"), "last_modified": validators.get("last_modified"),
+                               "body_hash": validators.get("body_hash"), "size": len(payload), "atime": time.time()}
+            self._evict()
+
+    def _evict(self) -> None:
+        total = sum(int(e.get("size") or 0) for e in self.index.values())
+        if total <= self.max_bytes: return
+        for key in sorted(self.index, key=lambda k: self.index[k].get("atime") or 0.0):
+            if total <= self.max_bytes: break
+            total -= int(self.index[key].get("size") or 0)
+            del self.index[key]; self.evicted += 1
+            try: self._file(key).unlink()
+            except Exception: pass
+
+    def save(self) -> None:
+        with self.lock: data = json.dumps(self.index)
+        tmp = self.root / "index.json.tmp"
+        tmp.write_text(data, encoding="utf-8"); os.replace(tmp, self.root / "index.json")
+
+    def summary(self) -> str:
+        with self.lock:
+            stats = {k: dict(v) for k, v in self.stats.items()}; size = sum(int(e.get("size") or 0) for e in self.index.values())
+        parts = []
+        for kind, st in stats.items():
+            hits = st["not_modified"] + st["same_hash"]; total = hits + st["miss"] + st["error"]
+            if not total: continue
+            parts.append("%s: hits=%d (304=%d, hash=%d) misses=%d erros=%d hit-rate=%.1f%%"
+                         % (kind, hits, st["not_modified"], st["same_hash"], st["miss"], st["error"], 100.0 * hits / total))
+        return "; ".join(parts + ["evictions=%d tamanho=%.1fMB" % (self.evicted, size / 1048576)])
+
+_HTTP_CACHE: Optional[HttpCache] = None
+_HTTP_CACHE_LOCK = threading.Lock()
+
+def get_http_cache() -> Optional[HttpCache]:
+    global _HTTP_CACHE
+    if not HTTP_CACHE_ENABLED: return None
+    with _HTTP_CACHE_LOCK:
+        if _HTTP_CACHE is None: _HTTP_CACHE = HttpCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_MB)
+        return _HTTP_CACHE
+
+def build_http_session(cookies: List[dict]):
+    """Sessão `requests` com os cookies do login (para revalidação condicional)."""
+    import requests
+    sess = requests.Session()
+    sess.headers.update({"User-Agent": UA, "Accept-Language": ACCEPT_LANG})
+    for c in cookies or []:
+        try: sess.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path") or "/")
+        except Exception: pass
+    return sess
+
+# ============================== Descoberta via sitemap/feed ==============================
+PRODUCT_URL_RE = re.compile(r"/produto[s]?/|/p/")
+
+def _http_get_bytes(url: str) -> Optional[bytes]:
+    import requests
+    cache = get_http_cache()
+    headers = {"User-Agent": UA, "Accept-Language": ACCEPT_LANG}
+    if cache: headers.update(cache.headers_for(url))
+    note_discovery_load()
+    try:
+        r = requests.get(url, headers=headers, timeout=HTTP_TIMEOUT_S)
+    except Exception as e:
+        log.debug("GET %s falhou: %s", url, e); return None
+    if cache:
+        unchanged, val = cache.check(url, r, kind="sitemap")
+        body = cache.get(url) if unchanged else None
+        if body is not None: r._content, r.status_code = body, 200
+        elif r.status_code == 200 and r.content: cache.put(url, r.content, val)
+    if r.status_code != 200 or not r.content:
+        log.debug("GET %s → HTTP %s", url, r.status_code); return None
+    data = r.content
+    if data[:2] == b"\x1f\x8b":
+        import gzip
+        try: data = gzip.decompress(data)
+        except Exception: return None
+    return data
+
+def _xml_root(data: Optional[bytes]):
+    import xml.etree.ElementTree as ET
+    if not data: return None
+    try: return ET.fromstring(data)
+    except ET.ParseError: return None
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1].split(":")[-1].lower()
+
+def _fold(txt: str) -> str:
+    import unicodedata
+    t = unicodedata.normalize("NFKD", txt or "")
+    return "".join(ch for ch in t if not unicodedata.combining(ch)).lower()
+
+def match_category(txt: str) -> Optional[str]:
+    t = _fold(txt)
+    for cname in CATEGORIES:
+        if _fold(cname) in t: return cname
+    return None
+
+def sitemap_roots() -> List[str]:
+    txt = (_http_get_bytes(urljoin(BASE, "/robots.txt")) or b"").decode("utf-8", "replace")
+    roots = [ln.split(":", 1)[1].strip() for ln in txt.splitlines() if ln.lower().startswith("sitemap:")]
+    return unique(roots) or [urljoin(BASE, "/sitemap.xml")]
+
+def collect_sitemap_urls() -> List[str]:
+    pending = sitemap_roots(); seen=set(); out=[]
+    while pending and len(seen) < SITEMAP_MAX_DOCS:
+        sm = pending.pop(0)
+        if sm in seen: continue
+        seen.add(sm)
+        root = _xml_root(_http_get_bytes(sm))
+        if root is None: continue
+        locs = [(el.text or "").strip() for el in root.iter() if _local(el.tag) == "loc"]
+        if _local(root.tag) == "sitemapindex": pending += [u for u in locs if u not in seen]
+        else: out += locs
+    log.info("Sitemap: %d documentos lidos, %d URLs", len(seen), len(out))
+    return unique(out)
+
+def collect_feed_categories(feed_url: Optional[str] = None) -> Dict[str, List[str]]:
+    """Lê um feed de produtos (RSS/Atom) e devolve {url normalizada: [categorias]}.
+    A categoria vem de product_type/google_product_category, casada com CATEGORIES."""
+    feed_url = feed_url or PRODUCT_FEED_URL
+    root = _xml_root(_http_get_bytes(feed_url)) if feed_url else None
+    if root is None: return {}
+    out: Dict[str, List[str]] = {}
+    for it in root.iter():
+        if _local(it.tag) not in {"item", "entry"}: continue
+        link = None; cats=[]
+        for ch in it:
+            name = _local(ch.tag)
+            if name == "link" and not link: link = (ch.text or ch.get("href") or "").strip()
+            elif name in {"product_type", "google_product_category", "category"}:
+                c = match_category(ch.text or ch.get("term") or "")
+                if c: cats.append(c)
+        if link: out[normalize_url(link)] = unique(cats)
+    log.info("Feed: %d produtos", len(out))
+    return out
+
+def load_previous_categories(path: str) -> Dict[str, List[str]]:
+    """Mapa produto→categorias da última saída JSON (bootstrap para produtos sem feed)."""
+    try:
+        with open(path, encoding="utf-8") as f: items = json.load(f)
+    except Exception: return {}
+    out: Dict[str, List[str]] = {}
+    for it in items or []:
+        url = it.get("url") or ""
+        cats = [c for c in (it.get("categories") or []) if c in CATEGORIES]
+        if cats: out[product_base_id(url) or normalize_url(url)] = cats
+    return out
+
+def discover_jobs_from_sitemap(prev_json: str) -> Tuple[List[Tuple[str, Optional[str]]], List[str]]:
+    """Descoberta leve: sitemap + feed. Devolve (jobs com categoria, URLs sem categoria conhecida)."""
+    feed = collect_feed_categories()
+    urls = unique([normalize_url(u) for u in collect_sitemap_urls()] + list(feed))
+    urls = [u for u in urls if PRODUCT_URL_RE.search(u)]
+    feed_by_key = {product_base_id(u) or u: c for u, c in feed.items() if c}
+    prev = load_previous_categories(prev_json)
+    jobs: List[Tuple[str, Optional[str]]] = []; gaps: List[str] = []; seen=set()
+    for u in urls:
+        k = product_base_id(u) or u
+        if k in seen: continue
+        seen.add(k)
+        cats = feed_by_key.get(k) or prev.get(k)
+        if cats: jobs += [(u, c) for c in cats]
+        else: gaps.append(u)
+    return jobs, gaps
+
 # ============================== Modelo & Parsing ==============================
 @dataclass
 class ProductItem:
@@ -475,7 +838,31 @@ def wait_for_product_ready(driver, timeout=PRODUCT_READY_TIMEOUT_S):
             driver.execute_script("window.scrollTo(0, 0);")
     except JavascriptException: pass
 
+BREADCRUMB_SEL = ("[class*='breadcrumb'] a, [class*='breadcrumb'] span, [class*='migalha'] a, "
+                  "[itemtype*='BreadcrumbList'] [itemprop='name'], nav[aria-label*='readcrumb'] a")
+
+def infer_categories(soup, url: str) -> List[str]:
+    """Categoria de um produto sem rótulo (descoberta via sitemap): breadcrumb da página
+    (texto ou link para a listagem da categoria) ou, na falta dele, a própria URL."""
+    cat_paths = {urlparse(cu).path.strip("/").lower(): cn for cn, cu in CATEGORIES.items()}
+    def by_path(href: str) -> Optional[str]:
+        path = urlparse(href or "").path.strip("/").lower()
+        for cp, cn in cat_paths.items():
+            if path == cp or path.startswith(cp + "-") or ("/" + cp) in "/" + path: return cn
+        return None
+    found = []
+    for el in soup.select(BREADCRUMB_SEL):
+        c = by_path(el.get("href") or "") or match_category(el.get_text(" ", strip=True))
+        if c: found.append(c)
+    if not found:
+        c = by_path(url)
+        if c: found.append(c)
+    return unique(found)[:1]
+
+MATERIAL_RE = re.compile(r"\b(Aço|Prata|Ródio|Rhodium|Ouro|Folheado|Banho)\b", re.I)
+
 def parse_title_desc_imgs(html: str, url: str, cat_label: Optional[str]) -> ProductItem:
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, "lxml")
     area = soup.select_one(".componente-produto-detalhes") or soup
 
@@ -494,12 +881,12 @@ def parse_title_desc_imgs(html: str, url: str, cat_label: Optional[str]) -> Prod
         if m: images.append(m.group(1))
     images = unique([u for u in images if "web.solvis.net.br/smileys" not in u])
 
-    categories=[cat_label] if cat_label else []
+    categories=[cat_label] if cat_label else infer_categories(soup, url)
 
     materials=[]
     for li in area.select(".descricao-produto li"):
         t=_clean(li.get_text(" ", strip=True))
-        if re.search(r"\b(Aço|Prata|Ródio|Rhodium|Ouro|Folheado|Banho)\b", t, re.I):
+        if MATERIAL_RE.search(t):
             materials.append(t)
     materials = unique(materials)[:10]
 
@@ -530,6 +917,8 @@ def _read_sku_and_stock(driver) -> Tuple[Optional[str], Optional[int]]:
     except Exception: pass
     return sku_txt, stock
 
+_PLACEHOLDERS = {"selecione","selecionar","escolha uma opção","choose an option"}
+
 def _find_variation_blocks(driver):
     return driver.find_elements(By.CSS_SELECTOR, ".componente-detalhes-variacoes .variacao-tipo")
 
@@ -554,7 +943,7 @@ def _list_group_options_text(driver, block) -> Tuple[str,List[str],Dict]:
             s = Select(sel)
             for opt in s.options:
                 t = re.sub(r"\s+", " ", (opt.text or "").strip())
-                if t and t.lower() not in {"selecione","selecionar","escolha uma opção","choose an option"}:
+                if t and t.lower() not in _PLACEHOLDERS:
                     if label=="Tamanho":
                         m = re.search(r"(\d{1,2})", t)
                         if m: t = m.group(1)
@@ -593,6 +982,52 @@ def _select_option(driver, label: str, meta: Dict, value: str) -> bool:
         return False
     return False
 
+# Só marcas de "não selecionável": opção esgotada continua clicável e deve ir ao JSON com estoque 0.
+JS_DISABLED_CHIPS = r"""
+return Array.from(arguments[0].querySelectorAll('.variacoes .variacao')).filter(el =>
+  el.disabled || el.getAttribute('aria-disabled') === 'true' || el.classList.contains('disabled')
+).map(el => (el.innerText || el.textContent || '').replace(/\s+/g, ' ').trim());
+"""
+JS_DISABLED_SELECT = r"""
+return Array.from(arguments[0].options).filter(o => o.disabled)
+  .map(o => (o.text || '').replace(/\s+/g, ' ').trim());
+"""
+
+def _clear_option(driver, meta: Dict) -> bool:
+    """Volta o grupo para "sem seleção" (só em <select> com opção placeholder)."""
+    if meta.get("type") != "select": return False
+    try:
+        sel = Select(meta["el"])
+        for idx, opt in enumerate(sel.options):
+            t = re.sub(r"\s+", " ", (opt.text or "").strip()).lower()
+            if not (opt.get_attribute("value") or "") or t in _PLACEHOLDERS:
+                sel.select_by_index(idx); return True
+    except Exception: pass
+    return False
+
+def _disabled_options(driver, label: str, meta: Dict) -> set:
+    """Opções do grupo que o site marcou como indisponíveis dada a seleção atual."""
+    js = JS_DISABLED_CHIPS if meta.get("type") == "chips" else JS_DISABLED_SELECT if meta.get("type") == "select" else None
+    if not js: return set()
+    try: txts = driver.execute_script(js, meta["el"]) or []
+    except Exception: return set()
+    out=set()
+    for t in txts:
+        if label=="Tamanho":
+            m = re.search(r"(\d{1,2})", t or "")
+            if m: t = m.group(1)
+        if t: out.add(t.strip().lower())
+    return out
+
+VARIATION_STATS = {"products": 0, "naive": 0, "actions": 0, "pruned": 0, "timeouts": 0}
+_VARIATION_LOCK = threading.Lock()
+
+def variation_stats_summary() -> str:
+    with _VARIATION_LOCK: v = dict(VARIATION_STATS)
+    saved = 100.0 * (1 - v["actions"] / v["naive"]) if v["naive"] else 0.0
+    return ("%d produtos, %d ações no navegador (antes: %d, -%.0f%%), %d combinações podadas, %d sem SKU"
+            % (v["products"], v["actions"], v["naive"], saved, v["pruned"], v["timeouts"]))
+
 def iterate_children(driver) -> Tuple[List[Dict], List[Dict]]:
     blocks = _find_variation_blocks(driver)
     if not blocks:
@@ -611,123 +1046,766 @@ def iterate_children(driver) -> Tuple[List[Dict], List[Dict]]:
         child = {"sku": sku, "estoque": stock} if sku else {}
         return [], ([child] if child else [])
 
-    from itertools import product
+    # Exploração em profundidade: grupos já selecionados (prefixo comum) não são
+    # re-clicados, e opções desabilitadas após a seleção anterior são podadas.
+    # A poda só vale se os grupos seguintes estão sem seleção na página: senão o
+    # "desabilitado" pode vir de uma escolha do ramo anterior, não do prefixo.
+    n = len(labels)
+    current: List[Optional[str]] = [None] * n
+    onpage: List[Optional[str]] = [None] * n   # o que a página mostra selecionado
+    st = {"clicks": 0, "waits": 0, "probes": 0, "pruned": 0, "timeouts": 0}
     children=[]
-    for combo in product(*options):
-        for lab, val, meta in zip(labels, combo, metas):
-            _select_option(driver, lab, meta, val)
-        WebDriverWait(driver, 8, poll_frequency=0.2).until(lambda d: _read_sku_and_stock(d)[0])
-        sku, stock = _read_sku_and_stock(driver)
-        ch = {"sku": sku, "estoque": stock}
-        for lab, val in zip(labels, combo):
-            ch[lab] = val
-        children.append(ch)
+
+    def explore(i: int) -> None:
+        checkpoint()
+        if i == n:
+            st["waits"] += 1
+            try: WebDriverWait(driver, 8, poll_frequency=0.2).until(lambda d: _read_sku_and_stock(d)[0])
+            except TimeoutException:
+                st["timeouts"] += 1; return
+            sku, stock = _read_sku_and_stock(driver)
+            ch = {"sku": sku, "estoque": stock}
+            for lab, val in zip(labels, current):
+                ch[lab] = val
+            children.append(ch); return
+        for j in range(i+1, n):
+            if onpage[j] is not None and _clear_option(driver, metas[j]):
+                onpage[j] = None; st["clicks"] += 1
+        disabled: set = set()
+        if all(v is None for v in onpage[i+1:]):
+            st["probes"] += 1
+            disabled = _disabled_options(driver, labels[i], metas[i])
+        for val in options[i]:
+            if val.strip().lower() in disabled:
+                st["pruned"] += math.prod(len(o) for o in options[i+1:]); continue
+            if current[i] != val:
+                _select_option(driver, labels[i], metas[i], val); st["clicks"] += 1
+                current[i] = onpage[i] = val
+                for j in range(i+1, n): current[j] = None
+            explore(i+1)
+
+    explore(0)
+    combos = math.prod(len(o) for o in options)
+    actions = st["clicks"] + st["waits"] + st["probes"]
+    naive = combos * (n + 1)
+    log.debug("Variações: %d combinações, %d podadas, %d sem SKU; ações %d (ingênuo: %d)",
+              combos, st["pruned"], st["timeouts"], actions, naive)
+    with _VARIATION_LOCK:
+        VARIATION_STATS["products"] += 1; VARIATION_STATS["naive"] += naive; VARIATION_STATS["actions"] += actions
+        VARIATION_STATS["pruned"] += st["pruned"]; VARIATION_STATS["timeouts"] += st["timeouts"]
 
     variations = [{"atributo": lab, "opcoes": ops} for lab, ops in zip(labels, options)]
     return variations, children
 
+# ============================== Agendamento de revisitas ==============================
+def product_key(url: str) -> str:
+    return product_base_id(url or "") or normalize_url(url or "")
+
+class RevisitScheduler:
+    """Prioriza revisitas pelos produtos cujo estoque/preço muda com frequência.
+
+    A taxa de mudança é uma média móvel exponencial por produto; a prioridade é
+    taxa × idade (horas desde a última visita). Produtos novos vêm sempre primeiro."""
+    def __init__(self, path: str = REVISIT_STATE_FILE):
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as f: self.state: Dict[str, Dict] = json.load(f) or {}
+        except Exception:
+            self.state = {}
+
+    @staticmethod
+    def signature(item: Dict) -> str:
+        import hashlib
+        stock = sorted((str(c.get("sku") or ""), c.get("estoque")) for c in (item.get("children") or []))
+        raw = json.dumps([stock, item.get("price")], ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def priority(self, key: str, now: float) -> float:
+        st = self.state.get(key)
+        if not st: return float("inf")
+        age_h = max(0.0, now - float(st.get("last_visit") or 0.0)) / 3600
+        prio = max(REVISIT_MIN_RATE, float(st.get("rate") or 0.0)) * age_h
+        return prio + (1e6 if age_h >= REVISIT_MAX_AGE_H else 0.0)
+
+    def select(self, jobs: List[Tuple[str, Optional[str]]], budget: int, now: Optional[float] = None,
+               must: Optional[set] = None) -> List[Tuple[str, Optional[str]]]:
+        """Escolhe os jobs do ciclo. Produtos em `must` (sem estado publicado no JSON)
+        entram sempre, mesmo acima do budget — senão o catálogo gravado sairia truncado."""
+        now = now if now is not None else time.time()
+        must = must or set()
+        by_key: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        for job in jobs: by_key.setdefault(product_key(job[0]), []).append(job)
+        forced = [k for k in by_key if k in must]
+        ranked = sorted((k for k in by_key if k not in must), key=lambda k: self.priority(k, now), reverse=True)
+        # O budget é em páginas: cada produto custa um job por categoria em que aparece.
+        left = budget - sum(len(by_key[k]) for k in forced)
+        chosen = list(forced)
+        for k in ranked:
+            if len(by_key[k]) > left: break
+            chosen.append(k); left -= len(by_key[k])
+        log.info("Revisitas: %d de %d produtos neste ciclo (budget=%d páginas, %d obrigatórios sem estado publicado)",
+                 len(chosen), len(by_key), budget, len(forced))
+        return [job for k in chosen for job in by_key[k]]
+
+    def update(self, items: List[Dict], now: Optional[float] = None) -> None:
+        now = now if now is not None else time.time()
+        changed = 0
+        for it in items:
+            key = product_key(it.get("url", ""))
+            sig = self.signature(it)
+            st = self.state.get(key)
+            if st is None:
+                self.state[key] = {"sig": sig, "rate": 0.5, "visits": 1, "changes": 0, "last_visit": now}
+                continue
+            diff = st.get("sig") != sig
+            changed += diff
+            st["rate"] = REVISIT_EWMA_ALPHA * float(diff) + (1 - REVISIT_EWMA_ALPHA) * float(st.get("rate") or 0.0)
+            st["visits"] = int(st.get("visits") or 0) + 1
+            st["changes"] = int(st.get("changes") or 0) + int(diff)
+            st["sig"] = sig; st["last_visit"] = now
+        log.info("Revisitas: %d produtos mudaram estoque/preço desde a última visita", changed)
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+class RequestBudget:
+    """Balde de fichas: acumula `per_hour` páginas por hora de tempo real decorrido
+    (independe da duração do ciclo e do --interval); teto de uma hora de fichas.
+    A descoberta e as páginas de produto gastam do mesmo balde."""
+    def __init__(self, per_hour: float, initial: float):
+        self.per_hour = float(per_hour); self.tokens = min(float(initial), self.per_hour)
+        self.t = time.monotonic()
+
+    def available(self) -> int:
+        now = time.monotonic()
+        self.tokens = min(self.per_hour, self.tokens + (now - self.t) / 3600 * self.per_hour); self.t = now
+        return max(0, int(self.tokens))
+
+    def spend(self, n: int) -> None:
+        self.tokens -= n
+
 # ============================== Consolidação / I/O ==============================
-def consolidate_by_product_id(items: List[Dict]) -> List[Dict]:
-    by: Dict[str, Dict] = {}
-    for it in items:
-        if not it: continue
-        pid = product_base_id(it.get("url","")) or it.get("sku_base") or it.get("url")
-        if pid not in by:
-            ref = dict(it)
-            ref.setdefault("categories", []); ref.setdefault("images", [])
-            ref.setdefault("variations", []); ref.setdefault("children", [])
-            ref.setdefault("materials", [])
-            by[pid] = ref
+def published_keys(path: str) -> set:
+    """Produtos presentes no último JSON gravado."""
+    try:
+        with open(path, encoding="utf-8") as f: return {product_key(it.get("url", "")) for it in (json.load(f) or [])}
+    except Exception:
+        return set()
+
+def _child_key(c: Dict) -> str:
+    if c.get("sku"): return f"SKU::{c['sku']}"
+    attrs = {k: v for k, v in c.items() if k not in {"sku","estoque"}}
+    return "ATTRS::" + json.dumps(attrs, sort_keys=True, ensure_ascii=False)
+
+def merge_product(by: Dict[str, Dict], it: Dict) -> None:
+    """Funde um item no mapa por produto (incremental; usado pelo estágio de consolidação)."""
+    if not it: return
+    pid = product_base_id(it.get("url","")) or it.get("sku_base") or it.get("url")
+    if pid not in by:
+        ref = dict(it)
+        ref.setdefault("categories", []); ref.setdefault("images", [])
+        ref.setdefault("variations", []); ref.setdefault("children", [])
+        ref.setdefault("materials", [])
+        by[pid] = ref
+        return
+    ref = by[pid]
+    ref["categories"] = unique((ref.get("categories") or []) + (it.get("categories") or []))
+    ref["images"]     = unique((ref.get("images") or []) + (it.get("images") or []))
+    ref["materials"]  = unique((ref.get("materials") or []) + (it.get("materials") or []))
+    map_exist = {v["atributo"]: list(v.get("opcoes", [])) for v in (ref.get("variations") or [])}
+    for v in (it.get("variations") or []):
+        a = v.get("atributo"); ops = v.get("opcoes", [])
+        if not a: continue
+        if a not in map_exist: map_exist[a] = []
+        for o in ops:
+            if o not in map_exist[a]: map_exist[a].append(o)
+    ref["variations"] = [{"atributo": k, "opcoes": map_exist[k]} for k in map_exist]
+    if not ref.get("description") and it.get("description"): ref["description"] = it["description"]
+    if not ref.get("title") and it.get("title"):             ref["title"] = it["title"]
+    if not ref.get("sku_base") and it.get("sku_base"):       ref["sku_base"] = it["sku_base"]
+
+    ch_map = { _child_key(c): idx for idx, c in enumerate(ref.get("children") or []) }
+    for ch in (it.get("children") or []):
+        k = _child_key(ch)
+        if k in ch_map:
+            r = ref["children"][ch_map[k]]
+            s1, s2 = r.get("estoque"), ch.get("estoque")
+            if isinstance(s2, int) and not isinstance(s1, int): r["estoque"] = s2
+            elif isinstance(s1, int) and isinstance(s2, int) and s2 > s1: r["estoque"] = s2
+            for kk, vv in ch.items():
+                if kk == "estoque": continue
+                if kk not in r and vv is not None: r[kk] = vv
         else:
-            ref = by[pid]
-            ref["categories"] = unique((ref.get("categories") or []) + (it.get("categories") or []))
-            ref["images"]     = unique((ref.get("images") or []) + (it.get("images") or []))
-            ref["materials"]  = unique((ref.get("materials") or []) + (it.get("materials") or []))
-            map_exist = {v["atributo"]: list(v.get("opcoes", [])) for v in (ref.get("variations") or [])}
-            for v in (it.get("variations") or []):
-                a = v.get("atributo"); ops = v.get("opcoes", [])
-                if not a: continue
-                if a not in map_exist: map_exist[a] = []
-                for o in ops:
-                    if o not in map_exist[a]: map_exist[a].append(o)
-            ref["variations"] = [{"atributo": k, "opcoes": map_exist[k]} for k in map_exist]
-            if not ref.get("description") and it.get("description"): ref["description"] = it["description"]
-            if not ref.get("title") and it.get("title"):             ref["title"] = it["title"]
-            if not ref.get("sku_base") and it.get("sku_base"):       ref["sku_base"] = it["sku_base"]
-
-            def key_child(c: Dict) -> str:
-                if c.get("sku"): return f"SKU::{c['sku']}"
-                attrs = {k: v for k, v in c.items() if k not in {"sku","estoque"}}
-                return "ATTRS::" + json.dumps(attrs, sort_keys=True, ensure_ascii=False)
-
-            ch_map = { key_child(c): idx for idx, c in enumerate(ref.get("children") or []) }
-            for ch in (it.get("children") or []):
-                k = key_child(ch)
-                if k in ch_map:
-                    r = ref["children"][ch_map[k]]
-                    s1, s2 = r.get("estoque"), ch.get("estoque")
-                    if isinstance(s2, int) and not isinstance(s1, int): r["estoque"] = s2
-                    elif isinstance(s1, int) and isinstance(s2, int) and s2 > s1: r["estoque"] = s2
-                    for kk, vv in ch.items():
-                        if kk == "estoque": continue
-                        if kk not in r and vv is not None: r[kk] = vv
-                else:
-                    ref["children"].append(ch)
+            ref["children"].append(ch)
 
+def finalize_products(by: Dict[str, Dict]) -> List[Dict]:
     for ref in by.values():
         for ch in ref.get("children", []):
             if not isinstance(ch.get("estoque"), int):
                 ch["estoque"] = 0
     return list(by.values())
 
+def consolidate_by_product_id(items: List[Dict]) -> List[Dict]:
+    by: Dict[str, Dict] = {}
+    for it in items: merge_product(by, it)
+    return finalize_products(by)
+
 def save_products_json(items: List[Dict], path=OUT_JSON):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(items, f, ensure_ascii=False, indent=2)
     log.info("Salvo %d produtos em %s", len(items), path)
 
-# ============================== Pipeline principal ==============================
-def run_scrape_and_save(headless: bool = True) -> List[Dict]:
-    gecko_path = GeckoDriverManager().install()
-    login_driver, cookies, localstorage = login_and_collect_auth(gecko_path, headless=headless)
+# ============================== Índice local (SQLite) ==============================
+INDEX_SCHEMA = """
+CREATE TABLE meta(key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE products(pid TEXT PRIMARY KEY, url TEXT, title TEXT, sku_base TEXT, stock_total INTEGER, data TEXT);
+CREATE TABLE skus(sku TEXT, pid TEXT, estoque INTEGER, attrs TEXT);
+CREATE TABLE categories(pid TEXT, category TEXT, norm TEXT);
+CREATE TABLE materials(pid TEXT, material TEXT, tag TEXT);
+CREATE INDEX ix_skus_sku ON skus(sku);
+CREATE INDEX ix_skus_pid ON skus(pid);
+CREATE INDEX ix_products_sku_base ON products(sku_base);
+CREATE INDEX ix_categories_norm ON categories(norm, pid);
+CREATE INDEX ix_materials_tag ON materials(tag, pid);
+"""
 
-    all_jobs: List[Tuple[str,str]] = []
+def index_db_path(json_path: Optional[str] = None) -> str:
+    return str(Path(json_path or OUT_JSON).with_suffix(".sqlite"))
+
+def _item_pid(it: Dict) -> str:
+    return product_base_id(it.get("url","")) or it.get("sku_base") or it.get("url") or ""
+
+def build_query_index(items: List[Dict], db_path: str) -> None:
+    """Grava o índice num arquivo temporário e troca de uma vez (leitores nunca veem meio-índice)."""
+    import sqlite3
+    t0 = time.perf_counter()
+    tmp = db_path + ".tmp"
+    if os.path.exists(tmp): os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.executescript(INDEX_SCHEMA)
+        prods=[]; skus=[]; cats=[]; mats=[]
+        for it in items:
+            pid = _item_pid(it)
+            children = it.get("children") or []
+            total = sum(c["estoque"] for c in children if isinstance(c.get("estoque"), int))
+            prods.append((pid, it.get("url"), it.get("title"), it.get("sku_base"), total, json.dumps(it, ensure_ascii=False)))
+            for c in children:
+                if not c.get("sku"): continue
+                attrs = {k: v for k, v in c.items() if k not in {"sku","estoque"}}
+                skus.append((c["sku"], pid, c.get("estoque"), json.dumps(attrs, ensure_ascii=False)))
+            cats += [(pid, c, _fold(c)) for c in unique(it.get("categories") or [])]
+            for m in unique(it.get("materials") or []):
+                tags = unique([_fold(t) for t in MATERIAL_RE.findall(m)]) or [_fold(m)]
+                mats += [(pid, m, t) for t in tags]
+        conn.executemany("INSERT OR REPLACE INTO products VALUES (?,?,?,?,?,?)", prods)
+        conn.executemany("INSERT INTO skus VALUES (?,?,?,?)", skus)
+        conn.executemany("INSERT INTO categories VALUES (?,?,?)", cats)
+        conn.executemany("INSERT INTO materials VALUES (?,?,?)", mats)
+        conn.executemany("INSERT INTO meta VALUES (?,?)", [("built_at", time.strftime("%Y-%m-%dT%H:%M:%S")),
+                                                          ("products", str(len(prods))), ("skus", str(len(skus)))])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, db_path)
+    log.info("Índice SQLite: %d produtos, %d SKUs em %s (%.2fs)", len(prods), len(skus), db_path, time.perf_counter() - t0)
+
+class ProductIndex:
+    """Leitura do índice gerado por build_query_index (somente leitura)."""
+    def __init__(self, db_path: Optional[str] = None):
+        import sqlite3
+        path = Path(db_path or index_db_path()).resolve()
+        if not path.exists(): raise FileNotFoundError(f"Índice não encontrado: {path}")
+        self.conn = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True)
+        self.conn.row_factory = sqlite3.Row
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def stock(self, sku: str) -> List[Dict]:
+        rows = self.conn.execute("SELECT s.sku, s.pid, s.estoque, s.attrs, p.title, p.url FROM skus s "
+                                 "JOIN products p ON p.pid = s.pid WHERE s.sku = ?", (sku,)).fetchall()
+        return [{**dict(r), "attrs": json.loads(r["attrs"] or "{}")} for r in rows]
+
+    def product(self, pid_or_url: str) -> Optional[Dict]:
+        pid = product_base_id(pid_or_url) or pid_or_url
+        r = self.conn.execute("SELECT data FROM products WHERE pid = ? OR sku_base = ? LIMIT 1", (pid, pid)).fetchone()
+        return json.loads(r["data"]) if r else None
+
+    def _summaries(self, sql: str, arg: str) -> List[Dict]:
+        return [dict(r) for r in self.conn.execute(sql, (arg,)).fetchall()]
+
+    def by_category(self, category: str) -> List[Dict]:
+        return self._summaries("SELECT DISTINCT p.pid, p.title, p.url, p.stock_total FROM categories c "
+                               "JOIN products p ON p.pid = c.pid WHERE c.norm = ? ORDER BY p.title", _fold(category))
+
+    def by_material(self, material: str) -> List[Dict]:
+        return self._summaries("SELECT DISTINCT p.pid, p.title, p.url, p.stock_total FROM materials m "
+                               "JOIN products p ON p.pid = m.pid WHERE m.tag = ? ORDER BY p.title", _fold(material))
+
+def query_main(argv: List[str]) -> int:
+    """Subcomando `query`: consultas rápidas ao índice SQLite, saída em JSON."""
+    import argparse
+    ap = argparse.ArgumentParser(prog="zarpellon-scraping-v1.0.py query", description="Consulta o índice local do último scraping.")
+    ap.add_argument("--db", default=None, help="Arquivo do índice (default=<out-json>.sqlite).")
+    ap.add_argument("--out-json", default=OUT_JSON, help="JSON de saída usado para derivar o índice (default=produtos_scrape.json).")
+    g = ap.add_mutually_exclusive_group(required=True)
+    g.add_argument("--sku", help="Estoque de um SKU.")
+    g.add_argument("--product", help="Produto completo por id ou URL.")
+    g.add_argument("--category", help="Produtos de uma categoria (ex.: Anéis).")
+    g.add_argument("--material", help="Produtos de um material (ex.: Prata, Ródio).")
+    a = ap.parse_args(argv)
+    try: idx = ProductIndex(a.db or index_db_path(a.out_json))
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr); return 2
+    try:
+        if a.sku: out = idx.stock(a.sku)
+        elif a.product: out = idx.product(a.product)
+        elif a.category: out = idx.by_category(a.category)
+        else: out = idx.by_material(a.material)
+    finally:
+        idx.close()
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return 0 if out else 1
+
+# ============================== Profiling ==============================
+class SamplingProfiler:
+    """Profiler por amostragem de todas as threads (login, workers, consolidação).
+
+    A cada intervalo lê a pilha de cada thread (sys._current_frames), conta tempo de
+    parede e atribui à pilha o CPU gasto pela thread desde a amostra anterior (relógio
+    de CPU por thread via /proc; no Windows/macOS via psutil, se instalado). Gera um único arquivo "folded" — raízes
+    `wall` e `cpu`, em ms — para flamegraph.pl/speedscope, e um relatório de hotspots."""
+    def __init__(self, prefix: str, interval_ms: float = PROFILE_SAMPLE_MS, top_n: int = PROFILE_TOP_N):
+        from collections import Counter
+        self.prefix = prefix; self.interval = interval_ms / 1000.0; self.top_n = top_n
+        self.wall: Counter = Counter(); self.cpu: Counter = Counter()
+        self.last_cpu: Dict[int, float] = {}
+        self.samples = 0; self.t0 = 0.0; self.wall_s = 0.0; self.self_cpu = 0.0
+        self._proc = None; self.cpu_source = self._pick_cpu_source()
+        self._stop = threading.Event(); self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._loop, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread: self._thread.join()
+        self.wall_s = time.perf_counter() - self.t0
+        try: self.write()
+        except Exception as e: log.warning("Falha ao gravar profile: %s", e)
+        return False
+
+    @staticmethod
+    def _label(frame) -> str:
+        co = frame.f_code
+        return f"{co.co_name} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})"
+
+    def _pick_cpu_source(self) -> Optional[str]:
+        """/proc (Linux) → psutil (Windows/macOS) → sem amostragem de CPU.
+
+        Lê por native_id e tolera thread que já terminou; pthread_getcpuclockid com
+        ident de thread encerrada (workers/estágios saem a cada ciclo) pode derrubar o processo."""
+        if os.path.isdir(f"/proc/self/task/{threading.get_native_id()}"): return "procfs"
+        try:
+            import psutil
+            self._proc = psutil.Process(); self._proc.threads()
+            return "psutil"
+        except Exception:
+            log.warning("Profile: amostragem de CPU por thread indisponível (instale psutil); só tempo de parede.")
+            return None
+
+    def _cpu_snapshot(self, threads) -> Dict[int, float]:
+        """CPU acumulado (s) por ident de thread Python."""
+        out: Dict[int, float] = {}
+        if self.cpu_source == "procfs":
+            tick = os.sysconf("SC_CLK_TCK")
+            for t in threads:
+                try:
+                    with open(f"/proc/self/task/{t.native_id}/stat", "rb") as f:
+                        fields = f.read().rsplit(b")", 1)[1].split()
+                    out[t.ident] = (int(fields[11]) + int(fields[12])) / tick   # utime + stime
+                except Exception: pass
+        elif self.cpu_source == "psutil":
+            try: by_tid = {th.id: th.user_time + th.system_time for th in self._proc.threads()}
+            except Exception: return out
+            for t in threads:
+                cpu = by_tid.get(getattr(t, "native_id", None))
+                if cpu is not None: out[t.ident] = cpu
+        return out
+
+    def _loop(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            threads = threading.enumerate()
+            names = {t.ident: t.name for t in threads}
+            cpus = self._cpu_snapshot(threads)
+            for ident, frame in sys._current_frames().items():
+                if ident == me: continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame)); frame = frame.f_back
+                key = names.get(ident, f"thread-{ident}") + ";" + ";".join(reversed(stack))
+                self.wall[key] += 1
+                cpu = cpus.get(ident)
+                if cpu is not None:
+                    prev = self.last_cpu.get(ident); self.last_cpu[ident] = cpu
+                    if prev is not None and cpu > prev: self.cpu[key] += cpu - prev
+            self.samples += 1
+        self.self_cpu = time.thread_time()
+
+    def _hotspots(self, counter, scale: float) -> List[Tuple[str, float]]:
+        from collections import Counter
+        leaf: Counter = Counter()
+        for key, v in counter.items(): leaf[key.rsplit(";", 1)[-1]] += v * scale
+        return [(lbl, v) for lbl, v in leaf.most_common(self.top_n) if v >= 0.5]
+
+    def write(self) -> None:
+        from collections import Counter
+        ms = self.interval * 1000
+        folded = self.prefix + ".folded"
+        with open(folded, "w", encoding="utf-8") as f:
+            for key, n in self.wall.items(): f.write(f"wall;{key} {max(1, round(n * ms))}\n")
+            for key, c in self.cpu.items():
+                if round(c * 1000) > 0: f.write(f"cpu;{key} {round(c * 1000)}\n")
+
+        by_thread: Counter = Counter()
+        for key, c in self.cpu.items(): by_thread[key.split(";", 1)[0]] += c
+        lines = [f"Profile: {self.wall_s:.1f}s de parede, {self.samples} amostras a cada {ms:.0f} ms",
+                 f"Overhead do amostrador: {self.self_cpu:.2f}s de CPU ({100.0 * self.self_cpu / self.wall_s if self.wall_s else 0.0:.2f}% de um núcleo)",
+                 f"Fonte de CPU por thread: {self.cpu_source or 'indisponível (só tempo de parede)'}",
+                 "", "CPU por thread (s):"]
+        lines += [f"  {name:<16} {c:8.2f}" for name, c in by_thread.most_common()]
+        lines += ["", f"Top {self.top_n} — CPU (self, ms):"]
+        lines += [f"  {v:10.0f}  {lbl}" for lbl, v in self._hotspots(self.cpu, 1000.0)]
+        lines += ["", f"Top {self.top_n} — tempo de parede (self, ms, somado entre threads):"]
+        lines += [f"  {v:10.0f}  {lbl}" for lbl, v in self._hotspots(self.wall, ms)]
+        top = self.prefix + "_top.txt"
+        with open(top, "w", encoding="utf-8") as f: f.write("\n".join(lines) + "\n")
+        log.info("Profile gravado em %s e %s (overhead %.2fs CPU)", folded, top, self.self_cpu)
+
+# ============================== Estágios do pipeline ==============================
+# discover → dedupe → fetch+variants (navegador) → parse → consolidate → write
+# Cada estágio é ligado ao seguinte por uma Queue limitada: um estágio rápido
+# bloqueia no put() quando o seguinte não acompanha (backpressure).
+class PipelineStats:
+    """Contadores por estágio e profundidade das filas (log periódico + resumo)."""
+    def __init__(self, queues: Dict[str, Queue]):
+        self.queues = queues
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {k: 0 for k in ("discovered", "deduped", "fetched", "cached", "parsed", "merged", "retry")}
+        self.depth_sum: Dict[str, int] = {k: 0 for k in queues}; self.depth_max: Dict[str, int] = {k: 0 for k in queues}
+        self.ticks = 0
+        self._stop = threading.Event(); self._thread: Optional[threading.Thread] = None
+
+    def inc(self, name: str, n: int = 1) -> None:
+        with self.lock: self.counts[name] = self.counts.get(name, 0) + n
+
+    def sample(self) -> str:
+        with self.lock:
+            self.ticks += 1; parts = []
+            for name, q in self.queues.items():
+                d = q.qsize(); self.depth_sum[name] += d; self.depth_max[name] = max(self.depth_max[name], d)
+                parts.append(f"{name}={d}/{q.maxsize}")
+            c = dict(self.counts)
+        return (" ".join(parts) + " | descobertos=%d dup=%d fetch=%d cache=%d parse=%d consolidados=%d retry=%d"
+                % (c["discovered"], c["deduped"], c["fetched"], c["cached"], c["parsed"], c["merged"], c["retry"]))
+
+    def _loop(self) -> None:
+        while not self._stop.wait(PIPE_STATS_EVERY_S):
+            log.info("Pipeline: %s", self.sample())
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="pipeline-stats", daemon=True); self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        if self._thread: self._thread.join()
+        self.sample()
+        with self.lock:
+            fill = {n: (self.depth_sum[n] / self.ticks / q.maxsize if self.ticks and q.maxsize else 0.0)
+                    for n, q in self.queues.items()}
+        # Fila cheia na média = o estágio que a consome é o gargalo.
+        return ", ".join(f"{n}: média {100*f:.0f}% cheia, pico {self.depth_max[n]}" for n, f in fill.items())
+
+def put_bp(q: Queue, item, alive=lambda: True) -> bool:
+    """put() com backpressure; desiste se o consumidor morreu (alive() == False)."""
+    while True:
+        try:
+            q.put(item, timeout=1.0); return True
+        except Full:
+            if not alive(): return False
+
+def drain_queue(q: Queue) -> list:
+    out = []
+    while True:
+        try: out.append(q.get_nowait())
+        except Empty: return out
+
+def parse_stage(parse_q: Queue, result_q: Queue, retry_list: list, stats: PipelineStats,
+                downstream=lambda: True) -> None:
+    """HTML + variações → ProductItem; itens vazios (ou sem consolidador vivo) vão para o retry lento."""
+    from os.path import commonprefix
+    cache = get_http_cache()
+    while True:
+        job = parse_q.get()
+        if job is None: break
+        url, cat, html, variations, children, validators = job
+        try:
+            base_item = parse_title_desc_imgs(html, url, cat)
+            skus = [c.get("sku") for c in children if c.get("sku")]
+            base_item.variations = variations; base_item.children = children
+            base_item.sku_base = commonprefix(skus) if skus else None
+            if not (base_item.title or base_item.description or base_item.children):
+                retry_list.append((url, cat)); stats.inc("retry"); continue
+            item = asdict(base_item)
+            if not put_bp(result_q, item, downstream):
+                log.error("Consolidação parou; encerrando %s.", threading.current_thread().name)
+                retry_list.append((url, cat)); stats.inc("retry"); return
+            stats.inc("parsed")
+            if cache is not None and validators:
+                cache.put(url, json.dumps(item, ensure_ascii=False).encode("utf-8"), validators)
+        except Exception as e:
+            log.error("Erro no parse de %s: %s", url, e); retry_list.append((url, cat)); stats.inc("retry")
+
+def consolidate_stage(result_q: Queue, by: Dict[str, Dict], stats: PipelineStats) -> None:
+    while True:
+        it = result_q.get()
+        if it is None: break
+        try: merge_product(by, it); stats.inc("merged")
+        except Exception as e: log.error("Erro ao consolidar %s: %s", (it or {}).get("url"), e)
+
+def iter_discovered_jobs(driver, prev_json: str):
+    """Descoberta em fluxo: gera (url, categoria) à medida que as categorias são lidas."""
+    gaps: List[str] = []
+    if DISCOVERY_MODE == "sitemap":
+        sm_jobs, gaps = discover_jobs_from_sitemap(prev_json)
+        n_total = len({product_base_id(u) or u for u, _ in sm_jobs}) + len(gaps)
+        log.info("Descoberta leve: %d jobs com categoria, %d produtos sem categoria", len(sm_jobs), len(gaps))
+        yield from sm_jobs
+        if n_total and len(gaps) <= SITEMAP_MAX_GAP_RATIO * n_total:
+            # Lacunas tratadas por produto: a categoria sai do breadcrumb da própria página.
+            for u in gaps: yield (u, None)
+            return
+        log.info("Sitemap ausente ou com lacunas demais (%d de %d); paginando categorias no navegador.", len(gaps), n_total)
+    # Navegador só quando não há sitemap/feed útil ou quando faltam categorias para muitos produtos.
+    found = set()
     for cname, curl in CATEGORIES.items():
         log.info("Categoria: %s (%s)", cname, curl)
-        links = collect_links_category_and_subs(login_driver, curl)
+        links = collect_links_category_and_subs(driver, curl)
         log.info("Links (dedupe por produto) em %s: %d", cname, len(links))
-        all_jobs += [(u, cname) for u in links]
-
-    try: login_driver.quit()
+        for u in links:
+            found.add(product_base_id(u) or u); yield (u, cname)
+    orphans = [u for u in gaps if (product_base_id(u) or u) not in found]
+    if orphans: log.info("Produtos no sitemap fora das listagens: %d (sem categoria)", len(orphans))
+    for u in orphans: yield (u, None)
+
+# ============================== Governador de recursos ==============================
+def checkpoint() -> None:
+    """Marca progresso da thread atual (worker); aborta se o governador matou seu navegador."""
+    t = threading.current_thread()
+    if isinstance(t, Worker):
+        if t.killed: raise RuntimeError("navegador reiniciado pelo governador")
+        t.heartbeat = time.perf_counter()
+
+def _browser_procs(driver) -> list:
+    import psutil
+    root = psutil.Process(driver.service.process.pid)
+    return [root] + root.children(recursive=True)
+
+def browser_rss_mb(driver) -> Optional[float]:
+    """RSS somado do geckodriver + Firefox + processos de conteúdo (requer psutil)."""
+    try: import psutil
+    except ImportError: return None
+    try:
+        total = 0
+        for p in _browser_procs(driver):
+            try: total += p.memory_info().rss
+            except psutil.Error: pass
+        return total / 1048576
+    except Exception: return None
+
+def kill_browser(driver) -> None:
+    try:
+        for p in reversed(_browser_procs(driver)):
+            try: p.kill()
+            except Exception: pass
+        return
+    except Exception: pass
+    # Sem psutil: mata o Firefox pelo PID que o geckodriver informa (os processos de
+    # conteúdo caem junto); só matar o geckodriver deixaria o navegador órfão.
+    import signal
+    try: os.kill(int(driver.capabilities["moz:processID"]), getattr(signal, "SIGKILL", signal.SIGTERM))
+    except Exception: pass
+    try: driver.service.process.kill()
     except Exception: pass
 
-    job_q: Queue = Queue()
-    for job in all_jobs: job_q.put(job)
+class BrowserGovernor(threading.Thread):
+    """Vigia os workers: reinicia navegadores travados ou inchados e limita a memória do pool.
+
+    Travamento (sem checkpoint() por GOV_STALL_S com job em andamento): mata o processo,
+    o que destrava a chamada Selenium pendente; o worker recoloca o job e abre outro
+    navegador. Excesso de memória: reinício "suave", entre um job e outro."""
+    def __init__(self, workers: List["Worker"]):
+        super().__init__(daemon=True, name="governor")
+        self.workers = workers
+        self._halt = threading.Event()
+        self.kills = 0; self.soft = 0; self.peak_total_mb = 0.0; self.no_psutil = False
+
+    def stop(self) -> str:
+        self._halt.set(); self.join()
+        mem = "n/d (psutil ausente ou processos inacessíveis)" if self.no_psutil else f"{self.peak_total_mb:.0f} MB"
+        return f"{self.kills} navegadores travados reiniciados, {self.soft} reinícios por memória, pico do pool {mem}"
+
+    def run(self) -> None:
+        while not self._halt.wait(GOV_CHECK_EVERY_S):
+            try: self.check()
+            except Exception as e: log.debug("Governador: %s", e)
+
+    def check(self) -> None:
+        now = time.perf_counter(); rss: Dict[Worker, float] = {}
+        for w in self.workers:
+            drv = w.driver
+            # Reinício suave já agendado não protege de travamento: ele só acontece entre jobs.
+            if not w.is_alive() or drv is None or w.killed: continue
+            if w.inflight and now - w.heartbeat > GOV_STALL_S:
+                w.restart_reason = f"sem progresso há {now - w.heartbeat:.0f}s"; w.killed = True
+                log.warning("Governador: worker%d %s; matando o navegador.", w.wid, w.restart_reason)
+                kill_browser(drv); self.kills += 1
+                continue
+            mb = browser_rss_mb(drv)
+            if mb is None:
+                self.no_psutil = True; continue
+            rss[w] = mb
+            if GOV_MAX_RSS_MB and mb > GOV_MAX_RSS_MB and not w.restart_reason:
+                w.restart_reason = f"RSS {mb:.0f} MB > {GOV_MAX_RSS_MB} MB"; self.soft += 1
+                log.info("Governador: worker%d %s; reinício agendado.", w.wid, w.restart_reason)
+        total = sum(rss.values()); self.peak_total_mb = max(self.peak_total_mb, total)
+        if GOV_MAX_TOTAL_RSS_MB and total > GOV_MAX_TOTAL_RSS_MB:
+            cand = [w for w in rss if not w.restart_reason]
+            if cand:
+                w = max(cand, key=rss.get)
+                w.restart_reason = f"pool {total:.0f} MB > {GOV_MAX_TOTAL_RSS_MB} MB"; self.soft += 1
+                log.info("Governador: worker%d reinício agendado (%s).", w.wid, w.restart_reason)
 
-    results: List[Dict] = []
-    res_lock = threading.Lock()
+# ============================== Pipeline principal ==============================
+def run_scrape_and_save(headless: bool = True, scheduler: Optional[RevisitScheduler] = None,
+                        budget: Optional[RequestBudget] = None) -> List[Dict]:
+    t_cycle = time.perf_counter()
+    with _PAGE_LOADS_LOCK:
+        for k in PAGE_LOADS: PAGE_LOADS[k] = 0
+    if get_http_cache() is not None: get_http_cache().reset_stats()
+    charged = {"product": 0}   # cargas de produto já cobradas do budget (reserva + acertos)
+
+    def charge_loads() -> None:
+        """Cobra do budget as cargas reais além da reserva (retentativas, hops, HTTP, retry lento)."""
+        if budget is None: return
+        with _PAGE_LOADS_LOCK: n = PAGE_LOADS["product"]
+        budget.spend(n - charged["product"]); charged["product"] = n
+    with _VARIATION_LOCK:
+        for k in VARIATION_STATS: VARIATION_STATS[k] = 0
+    gecko_path = resolve_geckodriver()
+    log.info("geckodriver: %s (%.2fs)", gecko_path, time.perf_counter() - t_cycle)
+    login_driver, cookies, localstorage = login_and_collect_auth(gecko_path, headless=headless, t_cycle=t_cycle)
+
+    job_q: Queue = Queue(maxsize=PIPE_JOB_QUEUE)
+    parse_q: Queue = Queue(maxsize=PIPE_PARSE_QUEUE)
+    result_q: Queue = Queue(maxsize=PIPE_RESULT_QUEUE)
+    stats = PipelineStats({"jobs": job_q, "html": parse_q, "itens": result_q})
     retry_later: List[Tuple[str,str]] = []
+    discovered_keys: set = set()
+    by: Dict[str, Dict] = {}
 
+    consolidator = threading.Thread(target=consolidate_stage, args=(result_q, by, stats), name="consolidate", daemon=True)
+    parsers = [threading.Thread(target=parse_stage, args=(parse_q, result_q, retry_later, stats, consolidator.is_alive),
+                                name=f"parse{i+1}", daemon=True) for i in range(PIPE_PARSE_THREADS)]
+    # Se parse/consolidação morrem, as filas enchem: os workers param em vez de travar no put().
+    downstream = lambda: consolidator.is_alive() and any(t.is_alive() for t in parsers)
     workers = [Worker(wid=i+1, gecko_path=gecko_path, cookies=cookies, localstorage=localstorage,
-                      job_q=job_q, out_list=results, out_lock=res_lock, retry_list=retry_later,
-                      headless=headless)
+                      job_q=job_q, parse_q=parse_q, result_q=result_q, retry_list=retry_later,
+                      stats=stats, headless=headless, tabs=TABS_PER_WORKER, downstream=downstream)
                for i in range(N_WORKERS)]
+
+    discovery_failed: List[str] = []   # descoberta parcial → não publica (JSON/índice ficariam truncados)
+
+    def produce():
+        alive = lambda: any(w.is_alive() for w in workers)
+        seen = set()
+        try:
+            src = iter_discovered_jobs(login_driver, OUT_JSON)
+            if scheduler is not None and budget is not None:
+                src = list(src)
+                discovered_keys.update(product_key(u) for u, _ in src)
+                budget.spend(PAGE_LOADS["discovery"])
+                quota = budget.available()
+                must = discovered_keys - published_keys(OUT_JSON)
+                src = scheduler.select(src, quota, must=must)
+                budget.spend(len(src)); charged["product"] += len(src)
+                log.info("Budget: %d páginas na descoberta, %d jobs de produto (cota do ciclo=%d)",
+                         PAGE_LOADS["discovery"], len(src), quota)
+            for job in src:
+                discovered_keys.add(product_key(job[0]))
+                if job in seen:
+                    stats.inc("deduped"); continue
+                seen.add(job); stats.inc("discovered")
+                if not put_bp(job_q, job, alive):
+                    log.error("Nenhum worker ativo; descoberta interrompida.")
+                    discovery_failed.append("nenhum worker ativo"); break
+        except Exception as e:
+            log.exception("Falha na descoberta de produtos")
+            discovery_failed.append(f"{type(e).__name__}: {e}")
+        finally:
+            try: login_driver.quit()
+            except Exception: pass
+            for _ in workers: put_bp(job_q, (None, None), alive)
+
+    producer = threading.Thread(target=produce, name="discover", daemon=True)
     t0 = time.perf_counter()
+    stats.start(); consolidator.start()
+    for t in parsers: t.start()
+    governor = BrowserGovernor(workers)
     for w in workers: w.start()
+    governor.start(); producer.start()
+    producer.join()
     for w in workers: w.join()
+    log.info("Governador: %s", governor.stop())
+    for _ in parsers: put_bp(parse_q, None, lambda: any(t.is_alive() for t in parsers))
+    for t in parsers: t.join()
+    put_bp(result_q, None, consolidator.is_alive); consolidator.join()
+    if not all(w.downstream_ok for w in workers):
+        # Sobras nas filas: jobs e HTMLs voltam para o retry lento; itens prontos são consolidados aqui.
+        left = [j for j in drain_queue(job_q) if j[0] is not None] + [j[:2] for j in drain_queue(parse_q) if j]
+        retry_later.extend(left)
+        for it in drain_queue(result_q):
+            if it is not None: merge_product(by, it)
+        log.error("Pipeline interrompido (parse/consolidação parou); %d jobs em fila foram para o retry lento.", len(left))
     dt = time.perf_counter()-t0
-    log.info("Processados %d itens com %d workers em %.1fs (≈%.2fs/it)", len(results), N_WORKERS, dt, (dt/len(results) if results else 0.0))
+    n_done = stats.counts["parsed"] + stats.counts["cached"]
+    log.info("Processados %d itens com %d workers × %d abas em %.1fs (≈%.2fs/it)", n_done, N_WORKERS, TABS_PER_WORKER, dt, (dt/n_done if n_done else 0.0))
+    log.info("Filas: %s", stats.stop())
+
+    log.info("Variações: %s", variation_stats_summary())
+    charge_loads()
+    if discovery_failed:
+        raise RuntimeError(f"descoberta incompleta ({discovery_failed[0]}); {OUT_JSON} e o índice não foram regravados")
+    if get_http_cache() is not None:
+        log.info("Cache HTTP: %s", get_http_cache().summary())
 
     if ENABLE_SLOW_RETRY and retry_later:
         log.info("Reprocessando %d URLs problemáticos em modo lento...", len(retry_later))
         slow = new_driver(gecko_path, headless=headless)
         prime_auth_on_driver(slow, cookies, localstorage)
         rng = random.Random(42)
-        fixed: List[Dict] = []
         for i, (url, cat) in enumerate(retry_later, 1):
             try:
                 if REFERER_HOP_ON_RETRY:
-                    slow.get(BASE + "/"); time.sleep(0.55 + rng.random()*0.45)
-                slow.get(url); time.sleep(0.75 + rng.random()*0.45)
+                    slow.get(BASE + "/"); note_product_load(); time.sleep(0.55 + rng.random()*0.45)
+                slow.get(url); note_product_load(); time.sleep(0.75 + rng.random()*0.45)
                 wait_for_product_ready(slow, timeout=2.0)
                 html = safe_page_source(slow)
                 if html:
@@ -739,48 +1817,119 @@ def run_scrape_and_save(headless: bool = True) -> List[Dict]:
                     sku_base = commonprefix(skus) if skus else None
                     base_item.variations = variations; base_item.children = children; base_item.sku_base = sku_base
                     if base_item.title or base_item.description or base_item.children:
-                        fixed.append(asdict(base_item))
+                        merge_product(by, asdict(base_item))
                 time.sleep(0.45 + rng.random()*0.35)
                 if i % 50 == 0: log.info("  [retry lento] %d/%d", i, len(retry_later))
             except Exception as e:
                 log.warning("Falha no retry lento %s: %s", url, e)
         try: slow.quit()
         except Exception: pass
-        results += fixed
 
-    consolidated = consolidate_by_product_id(results)
+    charge_loads()
+    if budget is not None:
+        log.info("Budget: %d cargas reais no ciclo (descoberta %d + produtos %d); saldo %.0f páginas",
+                 PAGE_LOADS["discovery"] + PAGE_LOADS["product"], PAGE_LOADS["discovery"], PAGE_LOADS["product"], budget.tokens)
+
+    if get_http_cache() is not None:
+        try: get_http_cache().save()
+        except Exception as e: log.warning("Falha ao gravar índice do cache HTTP: %s", e)
+
+    consolidated = finalize_products(by)
+    if scheduler is not None:
+        scheduler.update(consolidated); scheduler.save()
+        if budget is not None:
+            # Produtos não revisitados (ou que falharam) mantêm o último estado gravado.
+            fresh = {product_key(it.get("url", "")) for it in consolidated}
+            try:
+                with open(OUT_JSON, encoding="utf-8") as f: previous = json.load(f) or []
+            except Exception: previous = []
+            kept = [it for it in previous
+                    if product_key(it.get("url", "")) in discovered_keys and product_key(it.get("url", "")) not in fresh]
+            consolidated += kept
     log.info("Total consolidados: %d", len(consolidated))
     save_products_json(consolidated, OUT_JSON)
+    if INDEX_ENABLED:
+        try: build_query_index(consolidated, index_db_path(OUT_JSON))
+        except Exception as e: log.warning("Falha ao gerar índice SQLite: %s", e)
     return consolidated
 
 # ============================== Worker (scraping) ==============================
 class Worker(threading.Thread):
     def __init__(self, wid: int, gecko_path: str, cookies: List[dict], localstorage: Dict[str,str],
-                 job_q: Queue, out_list: list, out_lock: threading.Lock, retry_list: list,
-                 headless=True):
-        super().__init__(daemon=True)
+                 job_q: Queue, parse_q: Queue, result_q: Queue, retry_list: list,
+                 stats: PipelineStats, headless=True, tabs: int = 1, downstream=lambda: True):
+        super().__init__(daemon=True, name=f"worker{wid}")
         self.wid = wid
         self.gecko_path = gecko_path
         self.cookies = cookies
         self.localstorage = localstorage
         self.job_q = job_q
-        self.out_list = out_list
-        self.out_lock = out_lock
+        self.parse_q = parse_q
+        self.result_q = result_q
         self.retry_list = retry_list
+        self.stats = stats
         self.headless = headless
+        self.tabs = max(1, int(tabs))
+        self.downstream = downstream
+        self.downstream_ok = True
+        # Página de produto só é revalidada se o HTML for confiável para o estoque: sem isso
+        # o navegador abriria a página de qualquer jeito e a requisição HTTP seria só custo.
+        self.http_cache = get_http_cache() if HTTP_CACHE_TRUST_HTML else None
+        self.http = build_http_session(cookies) if self.http_cache else None
         self.driver = None
         self.logger = logging.getLogger(f"worker{wid}")
         self.rng = random.Random(1000 + wid)
+        # Estado observado/alterado pelo BrowserGovernor
+        self.heartbeat = time.perf_counter()
+        self.inflight: List[Tuple[str, str]] = []
+        self.restart_reason: Optional[str] = None
+        self.killed = False
+        self.pending: List[Tuple[str, str]] = []
+        self.requeued: Dict[Tuple[str, str], int] = {}
+
+    def _start_driver(self) -> None:
+        self.driver = new_driver(self.gecko_path, headless=self.headless)
+        try:
+            note_product_load(); self.driver.get(BASE + "/"); time.sleep(0.2)
+        except Exception:
+            pass
+        try:
+            prime_auth_on_driver(self.driver, self.cookies, self.localstorage)
+        except Exception:
+            pass
+        self.heartbeat = time.perf_counter()
+
+    def _restart_driver(self) -> None:
+        self.logger.warning("Reiniciando navegador (%s)", self.restart_reason)
+        drv, self.driver = self.driver, None
+        try:
+            if drv: drv.quit()
+        except Exception: pass
+        self.restart_reason = None; self.killed = False
+        self._start_driver()
+
+    def _next_job(self, block: bool = True) -> Tuple[Optional[str], Optional[str]]:
+        if self.pending: return self.pending.pop(0)
+        return self.job_q.get() if block else self.job_q.get_nowait()
+
+    def _requeue(self, job: Tuple[str, str], count: bool = True) -> None:
+        """Job interrompido pelo governador: volta para este worker (após o reinício)."""
+        n = self.requeued.get(job, 0)
+        if count and n >= GOV_REQUEUE_MAX:
+            self.retry_list.append(job); self.stats.inc("retry"); return
+        if count: self.requeued[job] = n + 1
+        self.pending.append(job)
 
     def _get_with_retries(self, url: str) -> Optional[str]:
         tries = 0
         while tries < RETRY_MAX_TRIES:
+            checkpoint()
             if tries > 0 and REFERER_HOP_ON_RETRY:
                 try:
-                    self.driver.get(BASE + "/"); time.sleep(0.25 + self.rng.random()*0.35)
+                    note_product_load(); self.driver.get(BASE + "/"); time.sleep(0.25 + self.rng.random()*0.35)
                 except Exception: pass
             try:
-                self.driver.get(url)
+                note_product_load(); self.driver.get(url)
             except TimeoutException:
                 self.logger.debug("Page load timeout (eager), seguindo waits…")
 
@@ -797,53 +1946,187 @@ class Worker(threading.Thread):
             time.sleep(back)
         return None
 
-    def run(self):
+    def _try_cached(self, url: str, cat: str) -> Tuple[bool, Optional[Dict]]:
+        """Revalida a página via HTTP. (True, _) se o item em cache foi reaproveitado;
+        senão (False, validadores) para gravar no cache após o scraping."""
+        if self.http_cache is None: return False, None
+        note_product_load()
+        try: r = self.http.get(url, headers=self.http_cache.headers_for(url), timeout=HTTP_TIMEOUT_S)
+        except Exception: r = None
+        unchanged, val = self.http_cache.check(url, r)
+        if r is None or r.status_code not in (200, 304): return False, None
+        payload = self.http_cache.get(url) if unchanged else None
+        if payload is not None:
+            try: item = json.loads(payload.decode("utf-8"))
+            except Exception: item = None
+            if item:
+                if cat: item["categories"] = [cat]
+                if self._emit(self.result_q, item, (url, cat)): self.stats.inc("cached")
+                return True, None
+        return False, val
+
+    def _handle_page(self, url: str, cat: str, html: str, validators: Optional[Dict] = None) -> None:
+        """Etapa que precisa do navegador (variações); o parse do HTML segue para o próximo estágio."""
         try:
-            self.driver = new_driver(self.gecko_path, headless=self.headless)
-            try:
-                self.driver.get(BASE + "/"); time.sleep(0.2)
-            except Exception:
-                pass
-            try:
-                prime_auth_on_driver(self.driver, self.cookies, self.localstorage)
-            except Exception:
-                pass
-            processed = 0; t0 = time.perf_counter()
-            while True:
+            variations, children = iterate_children(self.driver)
+        except Exception as e:
+            if self.killed: raise
+            self.logger.error("Falha ao iterar variações em %s: %s", url, e)
+            variations, children = [], []
+        self.stats.inc("fetched")
+        self._emit(self.parse_q, (url, cat, html, variations, children, validators), (url, cat))
+
+    def _emit(self, q: Queue, item, job: Tuple[str, str]) -> bool:
+        """put_bp para o estágio seguinte; se ele parou, o job vai para o retry lento."""
+        if put_bp(q, item, self._waiting): return True
+        self.retry_list.append(job); self.stats.inc("retry")
+        return False
+
+    def _downstream_alive(self) -> bool:
+        if self.downstream_ok and not self.downstream():
+            self.logger.error("Estágios de parse/consolidação pararam; encerrando worker.")
+            self.downstream_ok = False
+        return self.downstream_ok
+
+    def _waiting(self) -> bool:
+        # Espera por backpressure não é travamento (heartbeat em dia) — desde que
+        # parse/consolidação ainda estejam vivos para esvaziar as filas.
+        if not self._downstream_alive(): return False
+        self.heartbeat = time.perf_counter(); return True
+
+    def _run_tabs(self):
+        """Modo multi-aba: várias páginas carregando em paralelo num mesmo Firefox.
+
+        Enquanto uma aba é processada (parse + variações), as demais seguem carregando.
+        Os cookies de `prime_auth_on_driver` valem para todas as abas (mesmo perfil)."""
+        def open_tabs() -> List[str]:
+            hs = [self.driver.current_window_handle]
+            for _ in range(self.tabs - 1):
+                self.driver.switch_to.new_window("tab"); hs.append(self.driver.current_window_handle)
+            return hs
+        handles = open_tabs()
+        slots: Dict[str, Optional[Dict]] = {h: None for h in handles}
+        try:
+            self._tabs_loop(open_tabs, handles, slots)
+        except Exception:
+            # Sem isso os jobs das demais abas se perderiam (run() só drena `pending`).
+            for job in [j for j in slots.values() if j]: self.retry_list.append((job["url"], job["cat"]))
+            raise
+
+    def _tabs_loop(self, open_tabs, handles: List[str], slots: Dict[str, Optional[Dict]]) -> None:
+        exhausted = False
+        processed = 0; t0 = time.perf_counter()
+        while True:
+            if not self._downstream_alive():
+                for job in [j for j in slots.values() if j]: self.retry_list.append((job["url"], job["cat"]))
+                slots.clear(); return
+            if self.restart_reason:
+                killed = self.killed
+                for job in [j for j in slots.values() if j]: self._requeue((job["url"], job["cat"]), count=killed)
+                self._restart_driver()
+                handles[:] = open_tabs(); slots.clear(); slots.update({h: None for h in handles})
+            self.inflight = [(j["url"], j["cat"]) for j in slots.values() if j]
+            if not self.inflight: self.heartbeat = time.perf_counter()
+            for h in handles:
+                if slots[h] is not None or exhausted: continue
+                busy = any(slots.values())
                 try:
-                    url, cat = self.job_q.get(timeout=5)
+                    url, cat = self._next_job(block=not busy)
                 except Empty:
                     break
+                if url is None:
+                    exhausted = True; break
+                hit, val = self._try_cached(url, cat)
+                if hit:
+                    processed += 1; continue
+                slots[h] = {"url": url, "cat": cat, "t0": time.perf_counter(), "tries": 0, "val": val}
+                self.heartbeat = time.perf_counter(); self.inflight.append((url, cat))
+                try:
+                    self.driver.switch_to.window(h)
+                    tab_start_nav(self.driver, url)
+                except Exception as e:
+                    if self.killed: break   # o reinício no topo do laço recoloca as abas em andamento
+                    self.logger.error("Erro ao abrir %s na aba: %s", url, e)
+                    self.retry_list.append((url, cat)); slots[h] = None
+                    self.inflight.remove((url, cat))
+            if self.killed: continue
+
+            busy = [h for h in handles if slots[h]]
+            if not busy:
+                if exhausted: break
+                continue
+
+            progressed = False
+            for h in busy:
+                job = slots[h]
+                try:
+                    self.driver.switch_to.window(h)
+                    ready = tab_is_ready(self.driver)
+                    if not ready and time.perf_counter() - job["t0"] < PAGELOAD_TIMEOUT_S:
+                        continue
+                    progressed = True; checkpoint()
+                    html = ""
+                    if ready:
+                        try: wait_for_product_ready(self.driver, timeout=PRODUCT_READY_TIMEOUT_S)
+                        except Exception: pass
+                        html = safe_page_source(self.driver)
+                    if html:
+                        self._handle_page(job["url"], job["cat"], html, job["val"])
+                    else:
+                        job["tries"] += 1
+                        if job["tries"] < RETRY_MAX_TRIES:
+                            self.logger.warning("Sem HTML útil em %s (aba, tentativa %d). Recarregando...", job["url"], job["tries"])
+                            tab_start_nav(self.driver, job["url"]); job["t0"] = time.perf_counter()
+                            continue
+                        self.retry_list.append((job["url"], job["cat"]))
+                except Exception as e:
+                    if self.killed: break   # o reinício no topo do laço recoloca as abas em andamento
+                    self.logger.error("Erro em %s: %s", job["url"], e); self.retry_list.append((job["url"], job["cat"]))
+                slots[h] = None
+                processed += 1
+                if processed % 50 == 0:
+                    avg = (time.perf_counter() - t0) / processed
+                    self.logger.info("[+%d] ritmo≈%.2fs/it (%d abas)", processed, avg, len(handles))
+            if not progressed:
+                time.sleep(0.05)
+
+    def run(self):
+        try:
+            self._start_driver()
+            if self.tabs > 1:
+                self._run_tabs(); return
+            processed = 0; t0 = time.perf_counter()
+            while self._downstream_alive():
+                if self.restart_reason:
+                    self._restart_driver()
+                url, cat = self._next_job()
                 if url is None:
                     break
+                # heartbeat antes do job: após um get() longo da fila, o governador não pode
+                # ver o job novo com o heartbeat antigo.
+                self.heartbeat = time.perf_counter(); self.inflight = [(url, cat)]
                 try:
+                    hit, val = self._try_cached(url, cat)
+                    if hit: continue
                     html = self._get_with_retries(url)
                     if html is None:
                         self.retry_list.append((url, cat))
                     else:
-                        base_item = parse_title_desc_imgs(html, url, cat)
-                        try:
-                            variations, children = iterate_children(self.driver)
-                        except Exception as e:
-                            self.logger.error("Falha ao iterar variações em %s: %s", url, e)
-                            variations, children = [], []
-                        from os.path import commonprefix
-                        skus = [c.get("sku") for c in children if c.get("sku")]
-                        sku_base = commonprefix(skus) if skus else None
-                        base_item.variations = variations; base_item.children = children; base_item.sku_base = sku_base
-                        if not (base_item.title or base_item.description or base_item.children):
-                            self.retry_list.append((url, cat))
-                        else:
-                            with self.out_lock:
-                                self.out_list.append(asdict(base_item))
+                        self._handle_page(url, cat, html, val)
                 except Exception as e:
-                    self.logger.error("Erro em %s: %s", url, e); self.retry_list.append((url, cat))
+                    if self.killed:
+                        self._requeue((url, cat))
+                    else:
+                        self.logger.error("Erro em %s: %s", url, e); self.retry_list.append((url, cat))
                 finally:
+                    self.inflight = []
                     processed += 1
                     if processed % 50 == 0:
                         avg = (time.perf_counter() - t0) / processed
                         self.logger.info("[+%d] ritmo≈%.2fs/it", processed, avg)
         finally:
+            for job in self.pending: self.retry_list.append(job)
+            self.pending = []; self.inflight = []
             try:
                 if self.driver:
                     self.driver.quit()
@@ -854,6 +2137,9 @@ class Worker(threading.Thread):
 if __name__ == "__main__":
     import argparse, logging, time, json
 
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        sys.exit(query_main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(description="Scraper Zarpellon — somente scraping + JSON")
     # Execução
     parser.add_argument("--loop", action="store_true", help="Repetir scraping até Ctrl+C.")
@@ -863,14 +2149,60 @@ if __name__ == "__main__":
     # Scraping/persistência
     parser.add_argument("--out-json", default=OUT_JSON, help="Arquivo JSON de saída (default=produtos_scrape.json).")
     parser.add_argument("--workers", type=int, default=N_WORKERS, help="Workers de scraping (default=4).")
+    parser.add_argument("--tabs", type=int, default=TABS_PER_WORKER, help="Abas por worker/Firefox (default=1).")
+
+    parser.add_argument("--discovery", choices=["browser", "sitemap"], default=DISCOVERY_MODE,
+                        help="Descoberta de produtos: paginação no navegador ou sitemap/feed (default=browser).")
+    parser.add_argument("--budget", type=int, default=REVISIT_BUDGET_PER_H,
+                        help="Com --loop: páginas de produto por hora, priorizando os que mais mudam (default=0, sem limite).")
+    parser.add_argument("--http-cache", action="store_true", default=HTTP_CACHE_ENABLED,
+                        help="Revalidar sitemaps/feed via HTTP (ETag/Last-Modified/hash) e reaproveitar os inalterados.")
+    parser.add_argument("--profile", action="store_true", default=PROFILE_ENABLED,
+                        help="Amostrar CPU/tempo de parede de todas as threads e gerar flamegraph (.folded) + hotspots.")
+    parser.add_argument("--parse-threads", type=int, default=PIPE_PARSE_THREADS, help="Threads do estágio de parse (default=2).")
+    parser.add_argument("--queue-size", type=int, default=PIPE_JOB_QUEUE, help="Tamanho máximo da fila de jobs (default=256).")
+    parser.add_argument("--max-browser-mb", type=int, default=GOV_MAX_RSS_MB,
+                        help="Reinicia o Firefox de um worker acima desse RSS em MB (default=2048; 0=sem limite; requer psutil).")
+    parser.add_argument("--max-total-browser-mb", type=int, default=GOV_MAX_TOTAL_RSS_MB,
+                        help="Teto de memória somando todos os navegadores, em MB (default=0, sem teto).")
+    parser.add_argument("--stall-timeout", type=int, default=GOV_STALL_S,
+                        help="Segundos sem progresso num job até matar e reiniciar o navegador (default=180).")
+    parser.add_argument("--no-index", action="store_false", dest="index", default=INDEX_ENABLED,
+                        help="Não gerar o índice SQLite (<out-json>.sqlite) ao fim do ciclo.")
+    parser.add_argument("--http-cache-trust-html", action="store_true", default=HTTP_CACHE_TRUST_HTML,
+                        help="Revalidar também as páginas de produto (implica --http-cache): página inalterada reaproveita o "
+                             "item inteiro, inclusive o estoque, sem abrir o navegador. Só use se o estoque vier no HTML; "
+                             "página alterada é baixada duas vezes (HTTP + Firefox).")
+    parser.add_argument("--refresh-driver", action="store_true", help="Ignorar o cache e revalidar o geckodriver online.")
 
     args = parser.parse_args()
+    setup_logging()
+    if args.refresh_driver:
+        resolve_geckodriver(force_refresh=True)
     OUT_JSON  = args.out_json
     N_WORKERS = max(1, int(args.workers))
+    TABS_PER_WORKER = max(1, int(args.tabs))
+    DISCOVERY_MODE = args.discovery
+    HTTP_CACHE_ENABLED = args.http_cache or args.http_cache_trust_html
+    HTTP_CACHE_TRUST_HTML = args.http_cache_trust_html
+    PROFILE_ENABLED = args.profile
+    PIPE_PARSE_THREADS = max(1, int(args.parse_threads))
+    PIPE_JOB_QUEUE = max(1, int(args.queue_size))
+    GOV_MAX_RSS_MB = max(0, int(args.max_browser_mb))
+    GOV_MAX_TOTAL_RSS_MB = max(0, int(args.max_total_browser_mb))
+    GOV_STALL_S = max(10, int(args.stall_timeout))
+    INDEX_ENABLED = args.index
+
+    scheduler = RevisitScheduler(REVISIT_STATE_FILE) if args.loop and args.budget > 0 else None
+    budget = RequestBudget(args.budget, initial=args.budget * args.interval / 60) if scheduler else None
 
     def one_cycle():
         # esta função deve existir no seu arquivo — ela roda o scraping e já chama save_products_json(...)
-        data = run_scrape_and_save(headless=args.headless)
+        from contextlib import nullcontext
+        prof = (SamplingProfiler(f"{PROFILE_PREFIX}-{time.strftime('%Y%m%d-%H%M%S')}") if PROFILE_ENABLED
+                else nullcontext())
+        with prof:
+            data = run_scrape_and_save(headless=args.headless, scheduler=scheduler, budget=budget)
         logging.info("Scraping concluído com %d produtos (gravados em %s).", len(data), OUT_JSON)
 
     try: